@@ -0,0 +1,26 @@
+"""Add an index on torrent location for the rebalance query
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The score columns are deliberately left unindexed: the collector rewrites them every
+    # few seconds, and keeping those updates HOT matters more than the hourly ranking sort.
+    op.execute("""
+        CREATE INDEX idx_torrents_location ON torrents (location);
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX idx_torrents_location;")
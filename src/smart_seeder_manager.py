@@ -13,15 +13,22 @@ Database migrations are handled externally by Alembic.
 """
 
 import os
+import io
+import csv
+import errno
+import fcntl
 import time
 import psycopg2
+import psycopg2.pool
 import logging
 import shutil
 import threading
-from pathlib import Path
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import timedelta
 import qbittorrentapi
+from urllib3.util.retry import Retry
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -29,6 +36,8 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # --- Environment Variable Loading ---
 DB_CONFIG = { "host": os.environ.get('DB_HOST'), "port": os.environ.get('DB_PORT'), "name": os.environ.get('DB_NAME'), "user": os.environ.get('DB_USER'), "pass": os.environ.get('DB_PASS') }
 SSD_PATH = os.environ.get('SSD_PATH_IN_CONTAINER')
+# Normalized, separator-terminated form used for 'is this path on the SSD' checks.
+SSD_PATH_PREFIX = os.path.join(os.path.normpath(SSD_PATH), '') if SSD_PATH else None
 ARRAY_PATH = os.environ.get('ARRAY_PATH_IN_CONTAINER')
 
 # Loop intervals
@@ -37,10 +46,36 @@ DECISION_MAKING_INTERVAL = int(os.environ.get('CHECK_INTERVAL_SECONDS', 3600))
 
 # Logic Parameters
 SSD_TARGET_CAPACITY_PERCENT = int(os.environ.get('SSD_TARGET_CAPACITY_PERCENT', 90))
+SSD_TARGET_CAPACITY_RATIO = SSD_TARGET_CAPACITY_PERCENT / 100.0
 MAX_MOVES_PER_CYCLE = int(os.environ.get('MAX_MOVES_PER_CYCLE', 1))
+COPY_CONCURRENCY = int(os.environ.get('COPY_CONCURRENCY', 2))
+QBIT_API_WORKERS = 4
 DRY_RUN = os.environ.get('DRY_RUN', 'true').lower() == 'true'
 SSD_CACHE_TAG = 'ssdCache'
 PEER_STATS_CLEANUP_HOURS = 24
+# Column order of the rows synchronize_database() writes for new torrents.
+TORRENT_INSERT_COLUMNS = "hash, name, size, save_path, content_path, master_content_path, master_save_path, location, added_on, last_checked, total_uploaded"
+# Columns needed to promote or relegate a torrent; long path columns are only fetched for movers.
+MOVE_COLUMNS = "hash, name, size, save_path, content_path, master_save_path, master_content_path, io_miss_score, io_hit_score"
+DB_POOL_MAX_CONNECTIONS = 4
+DB_BATCH_PAGE_SIZE = 500  # rows per statement for execute_values batches
+COPY_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+COPY_RANGE_CHUNK_SIZE = 64 * 1024 * 1024  # 64 MiB per copy_file_range() call
+COPY_FILE_WORKERS = 4
+SSD_DELETE_WORKERS = 4
+BYTES_PER_GB = 1024 ** 3
+FICLONE = 0x40049409  # ioctl from linux/fs.h: share extents copy-on-write
+
+# HTTP session tuning for the qBittorrent WebUI: a single host pool (the client only
+# ever talks to one WebUI) of warm keep-alive connections, retrying transient gateway
+# errors with a backoff. Compressed responses are requested explicitly, since
+# maindata and torrent lists are large, highly repetitive JSON.
+QBIT_HTTPADAPTER_ARGS = {
+    "pool_connections": 1,
+    "pool_maxsize": QBIT_API_WORKERS,
+    "max_retries": Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], raise_on_status=False),
+}
+QBIT_EXTRA_HEADERS = {"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"}
 
 def get_qbit_client():
     """Establishes a connection to qBittorrent and returns a client object."""
@@ -49,7 +84,9 @@ def get_qbit_client():
             host=os.environ.get('QBIT_HOST'),
             port=os.environ.get('QBIT_PORT'),
             username=os.environ.get('QBIT_USER'),
-            password=os.environ.get('QBIT_PASS')
+            password=os.environ.get('QBIT_PASS'),
+            HTTPADAPTER_ARGS=QBIT_HTTPADAPTER_ARGS,
+            EXTRA_HEADERS=QBIT_EXTRA_HEADERS
         )
         client.auth_log_in()
         logging.info(f"Successfully connected to qBittorrent v{client.app.version} at {client.host}.")
@@ -60,92 +97,383 @@ def get_qbit_client():
         logging.error(f"Failed to connect to qBittorrent: {e}")
     return None
 
+def warn_if_cache_shares_array_filesystem():
+    """Warns when the SSD cache and the array are one filesystem: promotions would only hardlink, with no I/O benefit."""
+    if not SSD_PATH or not ARRAY_PATH:
+        return
+    try:
+        same_filesystem = os.stat(SSD_PATH).st_dev == os.stat(ARRAY_PATH).st_dev
+    except OSError as e:
+        logging.warning(f"Could not compare the filesystems of '{SSD_PATH}' and '{ARRAY_PATH}': {e}")
+        return
+    if same_filesystem:
+        logging.warning(f"SSD cache '{SSD_PATH}' is on the same filesystem as the array '{ARRAY_PATH}'. "
+                        "Promotions will be hardlinks: torrents get tagged as cached but keep seeding from the array. "
+                        "Map the cache to a separate SSD volume.")
+
 def db_connect():
-    """Establishes a persistent connection to the database."""
+    """Creates the shared PostgreSQL connection pool, retrying until the database is reachable."""
     while True:
         try:
-            conn = psycopg2.connect(dbname=DB_CONFIG['name'], user=DB_CONFIG['user'], password=DB_CONFIG['pass'], host=DB_CONFIG['host'], port=DB_CONFIG['port'])
+            db_pool = psycopg2.pool.ThreadedConnectionPool(1, DB_POOL_MAX_CONNECTIONS, dbname=DB_CONFIG['name'], user=DB_CONFIG['user'], password=DB_CONFIG['pass'], host=DB_CONFIG['host'], port=DB_CONFIG['port'])
             logging.info("Successfully connected to PostgreSQL database.")
-            return conn
+            return db_pool
         except psycopg2.OperationalError as e:
             logging.error(f"Failed to connect to PostgreSQL, retrying in 30 seconds... Error: {e}")
             time.sleep(30)
 
-def promote_torrent(qbit_client, db_conn, torrent):
-    """Copies a torrent to the SSD, repoints qBit, and adds the cache tag."""
-    source_path = Path(torrent['master_content_path'])
+@contextmanager
+def pooled_connection(db_pool):
+    """Checks a connection out of the pool; a connection that broke while in use is discarded, not returned."""
+    db_conn = db_pool.getconn()
+    broken = False
+    try:
+        yield db_conn
+    except (psycopg2.InterfaceError, psycopg2.OperationalError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(db_conn, close=broken)
+
+def sync_torrents(qbit_client, torrents_cache):
+    """
+    Applies qBittorrent's incremental maindata to a local {hash: torrent} cache.
+    Only torrents that changed since the previous request are transferred; the first
+    request of a client (or a server-forced full update) repopulates the whole cache.
+    """
+    maindata = qbit_client.sync.maindata.delta()
+    if maindata.get('full_update'):
+        torrents_cache.clear()
+    for torrent_hash, changes in maindata.get('torrents', {}).items():
+        torrents_cache.setdefault(torrent_hash, {'hash': torrent_hash}).update(changes)
+    for torrent_hash in maindata.get('torrents_removed', []):
+        torrents_cache.pop(torrent_hash, None)
+    return torrents_cache
+
+def fast_copy_file(src, dst):
+    """Copies a file and its metadata in-kernel where possible, without leaving the payload in the page cache."""
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        try:
+            # copy_file_range() keeps the data in the kernel and lets NFS or CoW filesystems offload it.
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_RANGE_CHUNK_SIZE):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            # Both descriptors already sit past whatever was copied, so carry on from there.
+            buffer = bytearray(COPY_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while (read := fsrc.readinto(buffer)):
+                fdst.write(view[:read])
+        fdst.flush()
+        if hasattr(os, 'posix_fadvise'):
+            # Dirty pages can only be dropped once they have been written back.
+            os.fdatasync(fdst.fileno())
+            os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(src, dst)
+    return dst
+
+def clone_file(src, dst):
+    """Creates dst as a copy-on-write reflink of src. Raises OSError if the filesystem cannot clone."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+    return dst
+
+def link_or_copy(src, dst):
+    """
+    Hardlinks a file into place, falling back to a reflink and then to fast_copy_file.
+    Hardlinks and reflinks require the SSD cache and the array to share a filesystem
+    (reflinks also need Btrfs, XFS with reflink=1, ...); across devices (EXDEV) or on
+    filesystems without support, promotion degrades to a full copy.
+    """
+    if os.stat(src).st_dev != os.stat(os.path.dirname(dst)).st_dev:
+        return fast_copy_file(src, dst)  # Different devices: link and clone would both fail with EXDEV.
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError as e:
+        if e.errno == errno.EEXIST and os.path.samefile(src, dst):
+            return dst  # Already linked; copying onto it would truncate the master file.
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK, errno.EEXIST):
+            raise
     try:
-        relative_path = source_path.relative_to(Path(torrent['master_content_path']).parent)
-    except ValueError:
+        return clone_file(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+            raise
+    return fast_copy_file(src, dst)
+
+def copy_tree(src_dir, dst_dir):
+    """Recreates a directory tree under dst_dir, symlinks included, and links or copies its files in parallel."""
+    files_to_copy = []
+    pending_dirs = [(src_dir, dst_dir)]
+    while pending_dirs:
+        src, dst = pending_dirs.pop()
+        os.makedirs(dst, exist_ok=True)
+        with os.scandir(src) as it:
+            for entry in it:
+                target = os.path.join(dst, entry.name)
+                if entry.is_symlink():
+                    # Recreate links as links: following them could copy data from outside the
+                    # torrent or recurse forever through a cycle.
+                    if os.path.lexists(target):
+                        os.unlink(target)
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append((entry.path, target))
+                else:
+                    files_to_copy.append((entry.path, target))
+
+    with ThreadPoolExecutor(max_workers=COPY_FILE_WORKERS) as file_executor:
+        for future in [file_executor.submit(link_or_copy, src, dst) for src, dst in files_to_copy]:
+            future.result()
+    return dst_dir
+
+def set_torrents_location(qbit_client, torrents, location):
+    """Repoints torrents to a new save path with a single API call, skipping those already there."""
+    torrent_hashes = [t['hash'] for t in torrents if os.path.normpath(t['save_path']) != os.path.normpath(location)]
+    if torrent_hashes:
+        qbit_client.torrents_set_location(torrent_hashes=torrent_hashes, location=location)
+    return torrent_hashes
+
+def wait_for_relocations(qbit_client, torrents, location_of, timeout=15, poll_interval=0.25):
+    """Polls qBittorrent until torrents report content under their new location and have finished moving.
+
+    Every pending torrent is checked with a single torrents/info call per tick. Returns the set of
+    hashes that were relocated before the timeout.
+    """
+    expected_prefixes = {t['hash']: os.path.join(os.path.normpath(location_of(t)), '') for t in torrents}
+    relocated = set()
+    deadline = time.time() + timeout
+    while True:
+        pending = [h for h in expected_prefixes if h not in relocated]
+        if pending:
+            for info in qbit_client.torrents_info(torrent_hashes=pending):
+                if info.state != 'moving' and os.path.normpath(info.content_path).startswith(expected_prefixes[info.hash]):
+                    relocated.add(info.hash)
+        if len(relocated) == len(expected_prefixes) or time.time() >= deadline:
+            return relocated
+        time.sleep(poll_interval)
+
+def copy_torrent_to_ssd(torrent):
+    """Copies a torrent's master content to the SSD. Returns the new (content_path, save_path) or None."""
+    source_path = os.path.normpath(torrent['master_content_path'])
+    relative_path = os.path.basename(source_path)
+    if not relative_path:
         logging.error(f"Cannot calculate relative path for '{source_path}'. Skipping promotion.")
-        return
+        return None
 
-    destination_content_path = Path(SSD_PATH) / relative_path
-    destination_save_path = destination_content_path.parent
+    destination_content_path = os.path.join(SSD_PATH, relative_path)
+    destination_save_path = os.path.dirname(destination_content_path)
 
     if DRY_RUN:
         logging.info(f"[DRY RUN] PROMOTION: Would move '{torrent['name']}' to '{destination_content_path}'.")
-        return
+        return None
 
     try:
         logging.info(f"PROMOTING '{torrent['name']}' by copying to SSD cache...")
-        destination_save_path.mkdir(parents=True, exist_ok=True)
-        if source_path.is_dir():
-            shutil.copytree(source_path, destination_content_path, dirs_exist_ok=True)
+        os.makedirs(destination_save_path, exist_ok=True)
+        if os.path.isdir(source_path):
+            copy_tree(source_path, destination_content_path)
         else:
-            shutil.copy2(source_path, destination_content_path)
-
-        logging.info(f"Copy complete. Repointing qBittorrent...")
-        qbit_client.torrents_set_location(torrent_hashes=torrent['hash'], location=str(destination_save_path))
-        qbit_client.torrents_add_tags(tags=SSD_CACHE_TAG, torrent_hashes=torrent['hash'])
-
-        with db_conn.cursor() as cursor:
-            cursor.execute("UPDATE torrents SET location = 'ssd', content_path = %s, save_path = %s WHERE hash = %s",
-                            (str(destination_content_path), str(destination_save_path), torrent['hash']))
-        db_conn.commit()
-        logging.info(f"PROMOTION successful for '{torrent['name']}'.")
+            link_or_copy(source_path, destination_content_path)
+        return destination_content_path, destination_save_path
     except Exception as e:
-        logging.error(f"Failed to promote torrent {torrent['hash']}: {e}", exc_info=True)
-
-def relegate_torrent(qbit_client, db_conn, torrent):
-    """Repoints qBit to the master save_path, removes cache tag, and deletes the SSD copy."""
-    ssd_content_path = Path(torrent['content_path'])
-    master_save_path = torrent['master_save_path']
-    master_content_path = torrent['master_content_path']
+        logging.error(f"Failed to copy torrent {torrent['hash']} to SSD: {e}", exc_info=True)
+        return None
 
-    if DRY_RUN:
-        logging.info(f"[DRY RUN] RELEGATION: Would re-point '{torrent['name']}' to '{master_save_path}' and delete from cache.")
+def delete_ssd_copy(path, attempts=5):
+    """Deletes a cached file or directory, retrying with exponential backoff while it is still busy."""
+    for attempt in range(attempts):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.unlink(path)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EACCES, errno.EPERM) or attempt == attempts - 1:
+                raise
+            logging.warning(f"'{path}' is still busy, retrying delete in {0.5 * 2 ** attempt:.1f}s...")
+            time.sleep(0.5 * 2 ** attempt)
+
+def repoint_by_location(qbit_client, items, location_of, torrent_of=lambda item: item):
+    """Repoints items with one setLocation call per target directory. Returns the items that were repointed.
+
+    The per-directory calls run concurrently over the client's keep-alive pool; a failed
+    directory is logged and its items are left out.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(location_of(item), []).append(item)
+
+    repointed = []
+    with ThreadPoolExecutor(max_workers=QBIT_API_WORKERS) as api_executor:
+        repoint_futures = {
+            api_executor.submit(set_torrents_location, qbit_client, [torrent_of(item) for item in group], location): (location, group)
+            for location, group in groups.items()
+        }
+        for future in as_completed(repoint_futures):
+            location, group = repoint_futures[future]
+            try:
+                future.result()
+                logging.info(f"Repointed {len(group)} torrent(s) to '{location}'.")
+                repointed.extend(group)
+            except Exception as e:
+                logging.error(f"Failed to repoint torrents to '{location}': {e}", exc_info=True)
+    return repointed
+
+def promote_torrents(qbit_client, db_conn, copied_torrents):
+    """Repoints qBit to the SSD copies, adds the cache tag, and records the new locations.
+
+    copied_torrents holds (torrent, destination_content_path, destination_save_path) tuples.
+    """
+    promoted = repoint_by_location(qbit_client, copied_torrents, lambda c: c[2], lambda c: c[0])
+    if not promoted:
         return
 
     try:
-        logging.info(f"RELEGATING '{torrent['name']}'. Repointing to master save_path...")
-        qbit_client.torrents_set_location(torrent_hashes=torrent['hash'], location=master_save_path)
-        qbit_client.torrents_remove_tags(tags=SSD_CACHE_TAG, torrent_hashes=torrent['hash'])
-
-        time.sleep(10)
+        qbit_client.torrents_add_tags(tags=SSD_CACHE_TAG, torrent_hashes=[torrent['hash'] for torrent, _, _ in promoted])
+    except Exception as e:
+        logging.error(f"Failed to tag promoted torrents: {e}", exc_info=True)
+
+    with db_conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE torrents SET location = 'ssd', content_path = data.content_path, save_path = data.save_path
+            FROM (VALUES %s) AS data (hash, content_path, save_path)
+            WHERE torrents.hash = data.hash
+        """, [(torrent['hash'], content_path, save_path) for torrent, content_path, save_path in promoted],
+            page_size=DB_BATCH_PAGE_SIZE)
+    db_conn.commit()
+    for torrent, _, _ in promoted:
+        logging.info(f"PROMOTION successful for '{torrent['name']}'.")
 
+def finish_promotions(qbit_client, db_conn, pending_copies, ideal_hashes):
+    """Repoints the promotions whose background copy has finished and drops them from pending_copies.
+
+    A copy may outlive the cycle that decided it, so only torrents still in the current ideal
+    set are repointed; the copies of the others are deleted again.
+    """
+    finished = [future for future in pending_copies if future.done()]
+    copied_torrents = []
+    for future in finished:
+        torrent, copied_paths = pending_copies[future], future.result()
+        if not copied_paths:
+            continue
+        if torrent['hash'] in ideal_hashes:
+            logging.info(f"Copy of '{torrent['name']}' complete.")
+            copied_torrents.append((torrent, *copied_paths))
+        else:
+            logging.info(f"Copy of '{torrent['name']}' complete, but it no longer ranks for the cache. Dropping the copy.")
+            delete_relegated_copy({**torrent, 'content_path': copied_paths[0]})
+    if copied_torrents:
+        promote_torrents(qbit_client, db_conn, copied_torrents)
+    for future in finished:
+        del pending_copies[future]
+
+def delete_relegated_copy(torrent):
+    """Deletes the SSD copy of a torrent qBit no longer uses. Returns True on success."""
+    ssd_content_path = os.path.normpath(torrent['content_path'])
+    try:
         logging.info(f"Deleting cached version from SSD: '{ssd_content_path}'")
-        if not str(ssd_content_path).startswith(SSD_PATH):
+        if not ssd_content_path.startswith(SSD_PATH_PREFIX):
              logging.error(f"SAFETY CHECK FAILED: Path '{ssd_content_path}' is not on the SSD. Aborting delete.")
-             return
-        if ssd_content_path.is_dir():
-            shutil.rmtree(ssd_content_path)
-        elif ssd_content_path.is_file():
-            ssd_content_path.unlink()
-
-        with db_conn.cursor() as cursor:
-            cursor.execute("UPDATE torrents SET location = 'array', content_path = %s, save_path = %s WHERE hash = %s",
-                            (master_content_path, master_save_path, torrent['hash']))
-        db_conn.commit()
-        logging.info(f"RELEGATION successful for '{torrent['name']}'.")
+             return False
+        delete_ssd_copy(ssd_content_path)
+        return True
     except Exception as e:
         logging.error(f"Failed to relegate torrent {torrent['hash']}: {e}", exc_info=True)
+        return False
 
-
-def data_collector_loop():
+def relegate_torrents(qbit_client, db_conn, torrents):
+    """Relegates a batch of torrents back to the array. Returns the torrents that were relegated."""
+    if DRY_RUN:
+        for torrent in torrents:
+            logging.info(f"[DRY RUN] RELEGATION: Would re-point '{torrent['name']}' to '{torrent['master_save_path']}' and delete from cache.")
+        return []
+
+    # Repoint every torrent sharing a master directory in one call (directories in parallel)
+    # and untag the whole batch in another, then wait on them together while qBittorrent moves them all.
+    logging.info(f"RELEGATING {len(torrents)} torrent(s). Repointing to their master save_path...")
+    repointed = repoint_by_location(qbit_client, torrents, lambda t: t['master_save_path'])
+    if repointed:
+        try:
+            qbit_client.torrents_remove_tags(tags=SSD_CACHE_TAG, torrent_hashes=[t['hash'] for t in repointed])
+        except Exception as e:
+            logging.error(f"Failed to untag relegated torrents: {e}", exc_info=True)
+
+    # Only delete SSD copies once qBittorrent actually serves the torrent from the array.
+    relocated = wait_for_relocations(qbit_client, repointed, lambda t: t['master_save_path'])
+    for torrent in repointed:
+        if torrent['hash'] not in relocated:
+            logging.error(f"qBittorrent did not release '{torrent['content_path']}' in time. Aborting delete.")
+
+    # Deletes are independent trees on the same SSD, so a few run side by side.
+    with ThreadPoolExecutor(max_workers=SSD_DELETE_WORKERS) as delete_executor:
+        released = [t for t in repointed if t['hash'] in relocated]
+        relegated = [t for t, deleted in zip(released, delete_executor.map(delete_relegated_copy, released)) if deleted]
+    if not relegated:
+        return []
+
+    with db_conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE torrents SET location = 'array', content_path = data.content_path, save_path = data.save_path
+            FROM (VALUES %s) AS data (hash, content_path, save_path)
+            WHERE torrents.hash = data.hash
+        """, [(t['hash'], t['master_content_path'], t['master_save_path']) for t in relegated], page_size=DB_BATCH_PAGE_SIZE)
+    db_conn.commit()
+    for torrent in relegated:
+        logging.info(f"RELEGATION successful for '{torrent['name']}'.")
+    return relegated
+
+
+def synchronize_database(cursor, api_torrents):
+    """Reconciles the torrents table with qBittorrent: drops removed torrents, upserts new and renamed ones."""
+    current_timestamp = int(time.time())
+
+    api_hashes = {t['hash'] for t in api_torrents}
+    if api_hashes:
+        cursor.execute("DELETE FROM torrents WHERE hash NOT IN %s", (tuple(api_hashes),))
+
+    cursor.execute("SELECT hash, name FROM torrents WHERE hash = ANY(%s)", (list(api_hashes),))
+    existing_torrents = {row['hash']: row for row in cursor.fetchall()}
+
+    # New and renamed torrents go through a single UPSERT; everything else just gets its timestamp refreshed.
+    torrents_to_upsert = []
+    for t in api_torrents:
+        existing_torrent = existing_torrents.get(t['hash'])
+        if existing_torrent is None or existing_torrent['name'] != t['name']:
+            location = 'ssd' if os.path.normpath(t['content_path']).startswith(SSD_PATH_PREFIX) else 'array'
+            torrents_to_upsert.append((
+                t['hash'], t['name'], t['size'], t['save_path'], t['content_path'], t['content_path'], t['save_path'],
+                location, t['added_on'], current_timestamp, t['uploaded']
+            ))
+
+    if torrents_to_upsert and not existing_torrents:
+        # Cold start: the table is empty, so nothing can conflict and the whole list is streamed in with COPY.
+        csv_buffer = io.StringIO()
+        csv.writer(csv_buffer).writerows(torrents_to_upsert)
+        csv_buffer.seek(0)
+        cursor.copy_expert(f"COPY torrents ({TORRENT_INSERT_COLUMNS}) FROM STDIN WITH (FORMAT csv)", csv_buffer)
+    elif torrents_to_upsert:
+        execute_values(cursor, f"""
+            INSERT INTO torrents ({TORRENT_INSERT_COLUMNS})
+            VALUES %s
+            ON CONFLICT (hash) DO UPDATE SET name = EXCLUDED.name, last_checked = EXCLUDED.last_checked
+        """, torrents_to_upsert, page_size=DB_BATCH_PAGE_SIZE)
+    if existing_torrents:
+        cursor.execute("UPDATE torrents SET last_checked = %s WHERE hash = ANY(%s)",
+                       (current_timestamp, list(existing_torrents)))
+
+
+def data_collector_loop(db_pool):
     """Fast loop (every 15s). Connects and collects per-peer upload data."""
     qbit_client = get_qbit_client()
-    db_conn = db_connect()
+    torrents_cache = {}
     logging.info("Data Collector thread started and connected.")
 
     while True:
@@ -154,8 +482,8 @@ def data_collector_loop():
             if not qbit_client: qbit_client = get_qbit_client()
             if not qbit_client: continue
 
-            all_torrents = qbit_client.torrents_info()
-            active_torrents = [t for t in all_torrents if t.upspeed > 0]
+            all_torrents = sync_torrents(qbit_client, torrents_cache).values()
+            active_torrents = [t for t in all_torrents if t['upspeed'] > 0]
 
             if not active_torrents:
                 logging.info("Data Collector: Cycle check. No torrents with active upload speed detected.")
@@ -165,14 +493,24 @@ def data_collector_loop():
             total_io_hit_score = 0
             total_io_miss_score = 0
 
-            with db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with pooled_connection(db_pool) as db_conn, db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT hash, location, total_uploaded FROM torrents WHERE hash = ANY(%s)",
+                               ([t['hash'] for t in active_torrents],))
+                db_torrents = {row['hash']: row for row in cursor.fetchall()}
+
+                # (hash, io_hit_delta, io_miss_delta, uploaded) rows applied in one statement
+                score_updates = []
                 for torrent in active_torrents:
-                    cursor.execute("SELECT location, total_uploaded FROM torrents WHERE hash = %s", (torrent.hash,))
-                    db_torrent = cursor.fetchone()
+                    db_torrent = db_torrents.get(torrent['hash'])
                     if not db_torrent: continue
 
+                    # Nothing uploaded since the last recorded total means no score and no write,
+                    # so skip the per-torrent peers request entirely.
+                    upload_delta = torrent['uploaded'] - db_torrent['total_uploaded']
+                    if upload_delta <= 0: continue
+
                     # Fetch peer data for the torrent
-                    peers_data = qbit_client.sync.torrent_peers(torrent_hash=torrent.hash)
+                    peers_data = qbit_client.sync.torrent_peers(torrent_hash=torrent['hash'])
                     
                     if not peers_data or 'peers' not in peers_data:
                         continue
@@ -181,23 +519,25 @@ def data_collector_loop():
                     active_peers_count = sum(1 for peer in peers_data['peers'].values() if peer['up_speed'] > 0)
 
                     if active_peers_count > 0:
-                        upload_delta = torrent.uploaded - db_torrent['total_uploaded']
-                        if upload_delta > 0:
-                            io_stress_score = upload_delta * active_peers_count
-                            
-                            # Determine score type and update total
-                            if db_torrent['location'] == 'ssd':
-                                score_column = 'io_hit_score'
-                                total_io_hit_score += io_stress_score
-                            else:
-                                score_column = 'io_miss_score'
-                                total_io_miss_score += io_stress_score
-
-                            # Update the database
-                            cursor.execute(
-                                f"UPDATE torrents SET {score_column} = {score_column} + %s, total_uploaded = %s WHERE hash = %s",
-                                (io_stress_score, torrent.uploaded, torrent.hash)
-                            )
+                        io_stress_score = upload_delta * active_peers_count
+                        
+                        # Determine score type and update total
+                        if db_torrent['location'] == 'ssd':
+                            score_updates.append((torrent['hash'], io_stress_score, 0, torrent['uploaded']))
+                            total_io_hit_score += io_stress_score
+                        else:
+                            score_updates.append((torrent['hash'], 0, io_stress_score, torrent['uploaded']))
+                            total_io_miss_score += io_stress_score
+
+                if score_updates:
+                    execute_values(cursor, """
+                        UPDATE torrents
+                        SET io_hit_score = torrents.io_hit_score + data.io_hit_delta,
+                            io_miss_score = torrents.io_miss_score + data.io_miss_delta,
+                            total_uploaded = data.uploaded
+                        FROM (VALUES %s) AS data (hash, io_hit_delta, io_miss_delta, uploaded)
+                        WHERE torrents.hash = data.hash
+                    """, score_updates, page_size=DB_BATCH_PAGE_SIZE)
                 db_conn.commit()
 
             # Log the aggregated results for the cycle if there was activity
@@ -211,9 +551,11 @@ def data_collector_loop():
                  logging.info(f"Data Collector: {len(active_torrents)} torrents processed. No new I/O score to log.")
 
         except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
-            logging.error(f"Data Collector: Database connection lost: {e}. Attempting to reconnect...");
-            if db_conn: db_conn.close()
-            db_conn = db_connect()
+            logging.error(f"Data Collector: Database connection lost: {e}. It was discarded from the pool; retrying next cycle.");
+        except qbittorrentapi.HTTPError as e:
+            # Expired sessions (403) are re-authenticated lazily by the client itself,
+            # so keep the existing session and its warm connections.
+            logging.error(f"Data Collector: qBittorrent API Error: {e}.");
         except qbittorrentapi.APIError as e:
             logging.error(f"Data Collector: qBittorrent API Error: {e}. Reconnecting...");
             qbit_client = None
@@ -221,10 +563,13 @@ def data_collector_loop():
             logging.error(f"Critical error in Data Collector thread: {e}", exc_info=True)
 
 
-def decision_maker_loop():
+def decision_maker_loop(db_pool):
     """Slow loop. Connects and analyzes data to perform torrent moves."""
     qbit_client = get_qbit_client()
-    db_conn = db_connect()
+    torrents_cache, synced_torrent_names = {}, None
+    # Promotion copies outlive the cycle that started them; their torrent is repointed once the copy lands.
+    copy_executor = ThreadPoolExecutor(max_workers=COPY_CONCURRENCY)
+    pending_copies, ideal_ssd_hashes = {}, set()
     logging.info("Decision Maker thread started and connected.")
     start_time = time.time()
 
@@ -235,74 +580,88 @@ def decision_maker_loop():
 
             logging.info("--- Decision Maker: Starting new verification cycle ---")
 
-            with db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                api_torrents = qbit_client.torrents_info()
-                current_timestamp = int(time.time())
-
-                api_hashes = {t.hash for t in api_torrents}
-                if api_hashes:
-                    cursor.execute("DELETE FROM torrents WHERE hash NOT IN %s", (tuple(api_hashes),))
-
-                for t in api_torrents:
-                    cursor.execute("SELECT hash FROM torrents WHERE hash = %s", (t.hash,))
-                    if not cursor.fetchone():
-                        location = 'ssd' if t.content_path.startswith(SSD_PATH) else 'array'
-                        cursor.execute("""
-                            INSERT INTO torrents (hash, name, size, save_path, content_path, master_content_path, master_save_path, location, added_on, last_checked, total_uploaded)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            t.hash, t.name, t.size, t.save_path, t.content_path, t.content_path, t.save_path,
-                            location, t.added_on, current_timestamp, t.uploaded
-                        ))
-                    else:
-                        cursor.execute("UPDATE torrents SET last_checked = %s, name = %s WHERE hash = %s",
-                                       (current_timestamp, t.name, t.hash))
-                db_conn.commit()
-                logging.info("Decision Maker: Torrent list synchronized with database.")
-
-                cursor.execute("SELECT * FROM torrents")
-                all_db_torrents = cursor.fetchall()
-                all_db_torrents.sort(key=lambda x: (x['io_miss_score'], x['io_hit_score']), reverse=True)
+            with pooled_connection(db_pool) as db_conn, db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                api_torrents = list(sync_torrents(qbit_client, torrents_cache).values())
+                torrent_names = {t['hash']: t['name'] for t in api_torrents}
+                if torrent_names == synced_torrent_names:
+                    logging.info("Decision Maker: No torrent added, removed or renamed since last cycle. Skipping synchronization.")
+                else:
+                    synchronize_database(cursor, api_torrents)
+                    db_conn.commit()
+                    synced_torrent_names = torrent_names
+                    logging.info("Decision Maker: Torrent list synchronized with database.")
 
                 try:
-                    total_ssd_space, _, _ = shutil.disk_usage(SSD_PATH)
-                    used_ssd_space = sum(f.stat().st_size for f in Path(SSD_PATH).glob('**/*') if f.is_file())
+                    total_ssd_space, used_ssd_space, _ = shutil.disk_usage(SSD_PATH)
                 except FileNotFoundError:
                     logging.error(f"SSD Path '{SSD_PATH}' not found. Skipping rebalancing cycle.")
                     time.sleep(DECISION_MAKING_INTERVAL); continue
 
-                target_ssd_usage = total_ssd_space * (SSD_TARGET_CAPACITY_PERCENT / 100.0)
-                logging.info(f"SSD Status: {(used_ssd_space / (1024**3)):.2f} GB used / {(total_ssd_space / (1024**3)):.2f} GB total. Target usage: {(target_ssd_usage / (1024**3)):.2f} GB.")
-
-                ideal_ssd_hashes, temp_size = set(), 0
-                for t in all_db_torrents:
-                    if (t['io_miss_score'] > 0 or t['io_hit_score'] > 0) and temp_size + t['size'] <= target_ssd_usage:
+                target_ssd_usage = total_ssd_space * SSD_TARGET_CAPACITY_RATIO
+                logging.info(f"SSD Status: {(used_ssd_space / BYTES_PER_GB):.2f} GB used / {(total_ssd_space / BYTES_PER_GB):.2f} GB total. Target usage: {(target_ssd_usage / BYTES_PER_GB):.2f} GB.")
+
+                # Greedy fill of the cache: torrents with I/O activity are walked in score order (sorted by
+                # PostgreSQL, only hash and size cross the wire) and each one that still fits the target is
+                # kept; one that doesn't is skipped without closing the cache to the smaller ones after it.
+                cursor.execute("""
+                    SELECT hash, size FROM torrents
+                    WHERE io_miss_score > 0 OR io_hit_score > 0
+                    ORDER BY io_miss_score DESC, io_hit_score DESC, hash
+                """)
+                ranked_torrents = cursor.fetchall()
+                smallest_size = min((t['size'] for t in ranked_torrents), default=0)
+                ideal_ssd_hashes, ideal_size = set(), 0
+                for t in ranked_torrents:
+                    if target_ssd_usage - ideal_size < smallest_size:
+                        break  # Nothing left in the ranking can fit; skip the rest of the walk.
+                    if ideal_size + t['size'] <= target_ssd_usage:
                         ideal_ssd_hashes.add(t['hash'])
-                        temp_size += t['size']
-
-                current_ssd_hashes = {t['hash'] for t in all_db_torrents if t['location'] == 'ssd'}
-                promotions_to_run = [t for t in all_db_torrents if t['hash'] in (ideal_ssd_hashes - current_ssd_hashes)]
-                relegations_to_run = [t for t in all_db_torrents if t['hash'] in (current_ssd_hashes - ideal_ssd_hashes)]
+                        ideal_size += t['size']
+
+                # Copies that landed since the last cycle are judged against this ranking, not the one that started them.
+                finish_promotions(qbit_client, db_conn, pending_copies, ideal_ssd_hashes)
+
+                # Only the rows of torrents whose location disagrees with that ideal set come back.
+                cursor.execute(f"""
+                    SELECT {MOVE_COLUMNS}, CASE WHEN location = 'ssd' THEN 'relegate' ELSE 'promote' END AS action
+                    FROM torrents
+                    WHERE (hash = ANY(%s) AND location IS DISTINCT FROM 'ssd')
+                       OR (location = 'ssd' AND NOT hash = ANY(%s))
+                """, (list(ideal_ssd_hashes), list(ideal_ssd_hashes)))
+                move_candidates = cursor.fetchall()
+                copying_hashes = {t['hash'] for t in pending_copies.values()}
+                promotions_to_run = [t for t in move_candidates if t['action'] == 'promote' and t['hash'] not in copying_hashes]
+                promotions_to_run.sort(key=lambda x: (x['io_miss_score'], x['io_hit_score']), reverse=True)
+                relegations_to_run = [t for t in move_candidates if t['action'] == 'relegate']
                 relegations_to_run.sort(key=lambda x: (x.get('io_miss_score', 0), x.get('io_hit_score', 0)))
 
                 logging.info(f"Analysis complete: {len(promotions_to_run)} promotion(s) and {len(relegations_to_run)} relegation(s) identified.")
 
-                moves_done = 0
-                for torrent in relegations_to_run:
-                    if moves_done >= MAX_MOVES_PER_CYCLE: break
-                    relegate_torrent(qbit_client, db_conn, torrent)
-                    moves_done += 1
-
-                current_used_space = sum(f.stat().st_size for f in Path(SSD_PATH).glob('**/*') if f.is_file())
+                # Track SSD usage in memory as moves complete instead of measuring the disk again.
+                # Copies still in flight are counted at full size, whatever they have written so far.
+                current_used_space = used_ssd_space + sum(t['size'] for t in pending_copies.values())
+                relegations_batch = relegations_to_run[:MAX_MOVES_PER_CYCLE]
+                for torrent in relegate_torrents(qbit_client, db_conn, relegations_batch):
+                    current_used_space -= torrent['size']
+                # Copies still in flight count as moves, and at most COPY_CONCURRENCY of them run at
+                # once, so slow copies never pile up a backlog across cycles.
+                moves_done = len(relegations_batch) + len(pending_copies)
+
+                promotions_to_copy = []
                 for torrent in promotions_to_run:
                     if moves_done >= MAX_MOVES_PER_CYCLE: break
+                    if len(pending_copies) + len(promotions_to_copy) >= COPY_CONCURRENCY: break
                     if current_used_space + torrent['size'] <= total_ssd_space:
-                        promote_torrent(qbit_client, db_conn, torrent)
+                        promotions_to_copy.append(torrent)
                         current_used_space += torrent['size']
                         moves_done += 1
                     else:
                         logging.warning(f"Skipping promotion of '{torrent['name']}': not enough free space on SSD.")
 
+                # Copies run in the background; finished ones are repointed and tagged together.
+                for torrent in promotions_to_copy:
+                    pending_copies[copy_executor.submit(copy_torrent_to_ssd, torrent)] = torrent
+
                 cursor.execute("SELECT SUM(io_hit_score) as total_hits, SUM(io_miss_score) as total_misses FROM torrents")
                 report_data = cursor.fetchone()
                 total_hit_score = report_data['total_hits'] or 0
@@ -323,13 +682,15 @@ def decision_maker_loop():
                 logging.info("="*80)
 
                 logging.info("Resetting I/O scores for the next decision cycle.")
-                cursor.execute("UPDATE torrents SET io_hit_score = 0, io_miss_score = 0")
+                cursor.execute("UPDATE torrents SET io_hit_score = 0, io_miss_score = 0 WHERE io_hit_score <> 0 OR io_miss_score <> 0")
                 db_conn.commit()
 
         except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
-            logging.error(f"Decision Maker: Database connection lost: {e}. Attempting to reconnect...");
-            if db_conn: db_conn.close()
-            db_conn = db_connect()
+            logging.error(f"Decision Maker: Database connection lost: {e}. It was discarded from the pool; retrying next cycle.");
+        except qbittorrentapi.HTTPError as e:
+            # Expired sessions (403) are re-authenticated lazily by the client itself,
+            # so keep the existing session and its warm connections.
+            logging.error(f"Decision Maker: qBittorrent API Error: {e}.");
         except qbittorrentapi.APIError as e:
             logging.error(f"Decision Maker: qBittorrent API Error: {e}. Reconnecting...");
             qbit_client = None
@@ -337,7 +698,16 @@ def decision_maker_loop():
             logging.critical(f"An unhandled critical error occurred in Decision Maker: {e}", exc_info=True)
 
         logging.info(f"Decision cycle complete. Next check in {DECISION_MAKING_INTERVAL / 3600:.1f} hour(s).")
-        time.sleep(DECISION_MAKING_INTERVAL)
+        next_cycle = time.time() + DECISION_MAKING_INTERVAL
+        while pending_copies and qbit_client and time.time() < next_cycle:
+            wait(pending_copies, timeout=next_cycle - time.time(), return_when=FIRST_COMPLETED)
+            try:
+                with pooled_connection(db_pool) as db_conn:
+                    finish_promotions(qbit_client, db_conn, pending_copies, ideal_ssd_hashes)
+            except Exception as e:
+                logging.error(f"Decision Maker: Failed to finish promotions: {e}. Retrying next cycle.", exc_info=True)
+                break
+        time.sleep(max(0, next_cycle - time.time()))
 
 
 if __name__ == "__main__":
@@ -345,9 +715,11 @@ if __name__ == "__main__":
         logging.warning("="*50); logging.warning("=== SCRIPT IS RUNNING IN DRY RUN MODE ==="); logging.warning("="*50)
 
     logging.info("Starting Seederr (v12.0 - Library-Powered)")
+    warn_if_cache_shares_array_filesystem()
 
-    collector_thread = threading.Thread(target=data_collector_loop, daemon=True)
-    decision_thread = threading.Thread(target=decision_maker_loop, daemon=True)
+    db_pool = db_connect()
+    collector_thread = threading.Thread(target=data_collector_loop, args=(db_pool,), daemon=True)
+    decision_thread = threading.Thread(target=decision_maker_loop, args=(db_pool,), daemon=True)
 
     collector_thread.start()
     decision_thread.start()